@@ -1,7 +1,11 @@
-import logging, boto3, re, argparse
+import logging, boto3, re, argparse, heapq, string, sys
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from datetime import datetime
-from itertools import groupby
-from typing import Tuple, Any
+from itertools import islice
+from operator import attrgetter
+from typing import Tuple, Any, Iterable, Iterator
 
 logging.basicConfig(
     level=logging.INFO,
@@ -9,7 +13,35 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def get_all_images(ecr_client: Any, repository_name: str) -> list:
+# Compiled once at import time, parse_image_tag runs for every tag in the repository
+_TAG_RE = re.compile(
+    r"^(?P<project_name>.+?)-"                                  # Project Name
+    r"(?P<project_hash>[a-f0-9]{7})-"                           # Project Hash
+    r"(?P<y>\d{4})-(?P<mo>\d{2})-(?P<d>\d{2})-"                 # Project Date, like %Y-%m-%d-%H-%M-%S
+    r"(?P<h>\d{2})-(?P<mi>\d{2})-(?P<s>\d{2})"
+    r"(?:-(?P<project_client>.+?))?-"                           # Project Client (Optional)
+    r"(?P<project_environment>[a-zA-Z]+)$",                     # Project Environment
+    re.ASCII                                                    # ECR tags are ASCII, \d is only [0-9]
+)
+# Shortest possible tag is a one character name and environment around the hash and date
+_MIN_TAG_LENGTH = len("n-0000000-2000-01-01-00-00-00-e")
+_TAG_LAST_CHARS = frozenset(string.ascii_letters)
+# Images validated together, one list_images page
+_VALIDATION_BATCH_SIZE = 1000
+
+@dataclass(slots=True)
+class ImageRecord:
+    """
+    Structured information of a validated image tag, slotted to keep per-image attribute access cheap.
+    """
+    project_name: str
+    project_hash: str
+    project_date: datetime
+    project_client: str
+    project_environment: str
+    image_digest: str | None = None
+
+def get_all_images(ecr_client: Any, repository_name: str) -> Iterator[dict]:
     """
     Retrieve all images from ECR.
 
@@ -18,34 +50,70 @@ def get_all_images(ecr_client: Any, repository_name: str) -> list:
         - region: The AWS region where the ECR repository is located.
 
     Output:
-        - A list of image details (e.g., image tags) from the specified ECR repository.
+        - An iterator over the image details (e.g., image tags) from the specified ECR repository, fetched page by page.
     """
     paginator = ecr_client.get_paginator("list_images")
-    images = []
+    image_count = 0
     
+    # ECR pagination tokens are sequential, so pages can't be fetched concurrently:
+    # request the largest page list_images allows to make as few round trips as possible.
+    # Untagged images can't be parsed, so they are filtered out server side instead of being paged through
     pagination_params = {
-        'repositoryName': repository_name
+        'repositoryName': repository_name,
+        'filter': {'tagStatus': 'TAGGED'},
+        'PaginationConfig': {'PageSize': 1000}
     }
 
     logger.info(f"Retrieving images from {repository_name} ECR...")
     try:
         for page in paginator.paginate(**pagination_params):
-            images.extend(page.get("imageIds", []))
+            page_images = page.get("imageIds", [])
+            image_count += len(page_images)
+            yield from page_images
     except ecr_client.exceptions.RepositoryNotFoundException as e:
         logger.error(f"Repository not found in ECR: {e}")
 
-    logger.info(f"Retrieved {len(images)} images from {repository_name} ECR.")
-    return images
+    logger.info(f"Retrieved {image_count} tagged images from {repository_name} ECR.")
+
+def get_validated_images(images: Iterable[dict], workers: int = 1) -> Iterator[ImageRecord]:
+    """
+    Validate image tags and extract relevant metadata, one batch of images at a time.
+
+    Input:
+        - images: An iterable of image details retrieved from ECR.
+        - workers: The number of processes validating batches in parallel, 1 validates them in this process.
+
+    Output: 
+        - An iterator over the validated image records, in the same order as the images.
+    """
+    images = iter(images)
+    batches = iter(lambda: list(islice(images, _VALIDATION_BATCH_SIZE)), [])
+
+    if workers <= 1:
+        for batch in batches:
+            yield from validate_image_batch(batch)
+        return
 
-def get_validated_images(images: list) -> dict:
+    # Only a few batches per worker are in flight, so images keep streaming instead of piling up
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for batch in batches:
+            pending.append(executor.submit(validate_image_batch, batch))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
+
+def validate_image_batch(images: list) -> list:
     """
-    Validate image tags and extract relevant metadata.
+    Validate a batch of image tags and extract relevant metadata.
 
     Input:
         - images: A list of image details retrieved from ECR.
 
     Output: 
-        - A list of validated image metadata dictionaries.
+        - A list of validated image records.
     """
     validated_images = []
     for image_detail in images:
@@ -58,14 +126,14 @@ def get_validated_images(images: list) -> dict:
         parsed_data = parse_image_tag(image_tag)
 
         if parsed_data:
-            parsed_data['imageDigest'] = digest
+            parsed_data.image_digest = digest
             validated_images.append(parsed_data)
         else:
-            logger.debug(f"Tag: '{image_tag}' - Ignored (invalid format or missing hash)")
+            logger.debug("Tag: '%s' - Ignored (invalid format or missing hash)", image_tag)
 
     return validated_images
 
-def parse_image_tag(image_tag: str) -> dict | None:
+def parse_image_tag(image_tag: str) -> ImageRecord | None:
     """
     Retrieve structured information from an image tag filtering by regular expression.
     Adapted to the following syntax: {project_name}-{project_hash}-{project_date}-{project_client}-{project_environment}
@@ -74,68 +142,108 @@ def parse_image_tag(image_tag: str) -> dict | None:
         - image_tag: The image tag to parse and extract information from.
 
     Output:
-        - A dictionary containing the parsed information from the image tag, or None if the tag is invalid.
+        - A record containing the parsed information from the image tag, or None if the tag is invalid.
     """
 
-    full_pattern_image_tag = re.compile(
-        r"^(?P<project_name>.+?)-"                                  # Project Name
-        r"(?P<project_hash>[a-f0-9]{7})-"                           # Project Hash
-        r"(?P<project_date>\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2})"    # Project Date, like %Y-%m-%d-%H-%M-%S
-        r"(?:-(?P<project_client>.+?))?-"                           # Project Client (Optional)
-        r"(?P<project_environment>[a-zA-Z]+)$"                      # Project Environment
-    )
-    
-    match = full_pattern_image_tag.match(image_tag)
+    if image_tag is None:
+        return None
+
+    # Cheap rejection: too short to hold every field, or not ending with the environment
+    if len(image_tag) < _MIN_TAG_LENGTH or image_tag[-1] not in _TAG_LAST_CHARS:
+        logger.warning("Tag: '%s' - Ignored (invalid format or missing hash)", image_tag)
+        return None
+
+    match = _TAG_RE.match(image_tag)
 
     if match:
         data = match.groupdict()
-
-        return {
-            "project_name": data.get('project_name'),
-            "project_hash": data.get('project_hash'),
-            "project_date": datetime.strptime(data.get('project_date'), "%Y-%m-%d-%H-%M-%S"),
-            "project_client": data.get('project_client') or 'N/A',
-            "project_environment": data.get('project_environment')
-        }
+        project_client = data.get('project_client')
+
+        # Name, client and environment repeat across most tags: interned, group keys share the same objects
+        return ImageRecord(
+            project_name=sys.intern(data.get('project_name')),
+            project_hash=data.get('project_hash'),
+            project_date=datetime(
+                int(data.get('y')), int(data.get('mo')), int(data.get('d')),
+                int(data.get('h')), int(data.get('mi')), int(data.get('s'))
+            ),
+            project_client=sys.intern(project_client) if project_client else 'N/A',
+            project_environment=sys.intern(data.get('project_environment'))
+        )
     
     else:
-        logger.warning(f"Tag: '{image_tag}' - Ignored (invalid format or missing hash)")
+        logger.warning("Tag: '%s' - Ignored (invalid format or missing hash)", image_tag)
         return None
 
-def get_digests_by_status(validated_images: dict, keep_versions: int) -> Tuple[set, set]:
+def get_digests_by_status(validated_images: Iterable[ImageRecord], keep_versions: int) -> Tuple[set, set]:
     """
     Retrieve the sets of image digests to keep and delete based on their status.
 
     Input:
-        - valid_tagged_images: A list of valid tagged images with their metadata.
+        - validated_images: An iterable of validated image records, consumed in a single pass.
 
     Output:
         - A tuple containing two sets: digests_to_keep and digests_to_delete.
     """
-    group_key = lambda image: (image['project_environment'], image['project_client'], image['project_name'])
-    validated_images.sort(key=group_key)
+    group_key = attrgetter('project_environment', 'project_client', 'project_name')
 
-    digests_to_keep = set()
+    # Per group: a min-heap whose root is the first entry to evict and the entry currently kept for each
+    # digest, both bounded by keep_versions. Heap entries replaced in kept are stale and skipped lazily
+    groups = defaultdict(lambda: ([], {}))
+    tag_counts = defaultdict(int)
     digests_to_delete = set()
 
-    for key, group in groupby(validated_images, key=group_key):
-        group_list = list(group)
+    for sequence, image in enumerate(validated_images):
+        key = group_key(image)
+        heap, kept = groups[key]
+        tag_counts[key] += 1
+
+        # Newer dates rank higher, on equal dates the image seen first does
+        digest = image.image_digest
+        entry = (image.project_date, -sequence, digest)
+
+        # A digest tagged several times within the same group only counts once, with its newest date
+        kept_entry = kept.get(digest)
+        if kept_entry is not None:
+            if entry[0] > kept_entry[0]:
+                kept[digest] = entry
+                heapq.heappush(heap, entry)
+
+                # Stale entries never outnumber the kept ones for long
+                if len(heap) > 2 * len(kept):
+                    heap[:] = kept.values()
+                    heapq.heapify(heap)
+            continue
 
-        group_list.sort(key=lambda image: image['project_date'], reverse=True)
-        images_to_keep = group_list[:keep_versions]
-        images_to_delete = group_list[keep_versions:]
+        if len(kept) < keep_versions:
+            kept[digest] = entry
+            heapq.heappush(heap, entry)
+            continue
 
-        logging.info(
-            f"Group: {key} | Total: {len(group_list)} | To keep: {len(images_to_keep)} | To delete: {len(images_to_delete)}"
-        )
+        while heap and kept.get(heap[0][2]) is not heap[0]:
+            heapq.heappop(heap)
+
+        # Older than everything kept so far: deleted, unless kept elsewhere
+        if not heap or entry < heap[0]:
+            digests_to_delete.add(digest)
+            continue
+
+        # The new entry takes the place of the oldest one kept so far, O(log keep_versions)
+        _, _, evicted_digest = heapq.heapreplace(heap, entry)
+        del kept[evicted_digest]
+        kept[digest] = entry
+        digests_to_delete.add(evicted_digest)
 
-        for image in images_to_keep:
-            digests_to_keep.add(image['imageDigest'])
-        for image in images_to_delete:
-            digests_to_delete.add(image['imageDigest'])
+    # Counts tags, not digests: distinct digests per group would take memory proportional to the group
+    for key, (_, kept) in groups.items():
+        logger.info("Group: %s | Tags: %d | Digests to keep: %d", key, tag_counts[key], len(kept))
 
-    final_digests_to_delete = digests_to_delete - digests_to_keep
-    return digests_to_keep, final_digests_to_delete
+    digests_to_keep = {digest for _, kept in groups.values() for digest in kept}
+
+    # Digests kept by any group are never deleted, even if another group would drop them
+    digests_to_delete -= digests_to_keep
+
+    return digests_to_keep, digests_to_delete
 
 def delete_images(ecr_client: Any, final_digests_to_delete: set, args: Any):
     """
@@ -149,26 +257,35 @@ def delete_images(ecr_client: Any, final_digests_to_delete: set, args: Any):
         logger.info("No images to delete.")
         return
 
-    logger.info(f"Total images to delete: {len(final_digests_to_delete)}")
+    logger.info("Total images to delete: %d", len(final_digests_to_delete))
 
     if args.execute:
         logger.warning("--- Execution Mode ---")
         image_ids_to_delete = [{'imageDigest': digest} for digest in final_digests_to_delete]
 
         # Delete with chunks of 100
-        for i in range(0, len(image_ids_to_delete), 100):
-            chunk = image_ids_to_delete[i:i+100]
-            try:
-                response = ecr_client.batch_delete_image(
+        chunks = [image_ids_to_delete[i:i+100] for i in range(0, len(image_ids_to_delete), 100)]
+
+        # Batches are independent, send them concurrently (boto3 clients are thread-safe)
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            futures = [
+                executor.submit(
+                    ecr_client.batch_delete_image,
                     repositoryName=args.repository_name,
                     imageIds=chunk
                 )
-                logger.info(f"Successfully deleted a batch of {len(response.get('imageIds', []))} images.")
-                
-                if response.get('failures'):
-                    logger.error(f"Failures: {response['failures']}")
-            except Exception as e:
-                logger.error(f"Error deleting image batch: {e}")
+                for chunk in chunks
+            ]
+
+            for future in as_completed(futures):
+                try:
+                    response = future.result()
+                    logger.info("Successfully deleted a batch of %d images.", len(response.get('imageIds', [])))
+                    
+                    if response.get('failures'):
+                        logger.error("Failures: %s", response['failures'])
+                except Exception as e:
+                    logger.error("Error deleting image batch: %s", e)
     else:
         logger.warning("--- Simulation Mode (Dry Run) ---")
         logger.info("The following image digests would be deleted:")
@@ -181,11 +298,11 @@ def main(args):
 
     ecr_client = boto3.client(
         "ecr", region_name=args.region, 
-        config=boto3.session.Config(retries={"max_attempts": 10})
+        config=boto3.session.Config(retries={"max_attempts": 10}, max_pool_connections=32)
     )
 
     images = get_all_images(ecr_client, args.repository_name)
-    validated_images = get_validated_images(images)
+    validated_images = get_validated_images(images, args.parse_workers)
     _, images_to_delete = get_digests_by_status(validated_images, args.keep_versions)
     delete_images(ecr_client, images_to_delete, args)
 
@@ -194,6 +311,7 @@ if __name__ == "__main__":
     parser.add_argument("--repository_name", help="The name of the ECR repository to manage images from.")
     parser.add_argument("--region", help="The AWS region where the ECR repository is located.")
     parser.add_argument("--keep-versions", type=int, default=3, help="Number of recent versions to keep per group.")
+    parser.add_argument("--parse-workers", type=int, default=1, help="Number of processes parsing image tags in parallel. Default is 1, parsing in the main process.")
     parser.add_argument("--execute", action="store_true", help="Flag to actually delete images. Default is dry run.")
 
     cli_args = parser.parse_args()
@@ -1,7 +1,7 @@
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from main import parse_image_tag, get_digests_by_status
+from main import parse_image_tag, get_validated_images, get_digests_by_status
 
 
 class TestMain(unittest.TestCase):
@@ -10,31 +10,76 @@ class TestMain(unittest.TestCase):
         tag = "myproj-1a2b3c4-2025-09-25-15-30-00-clientA-prod"
         parsed = parse_image_tag(tag)
         self.assertIsNotNone(parsed)
-        self.assertEqual(parsed["project_name"], "myproj")
-        self.assertEqual(parsed["project_hash"], "1a2b3c4")
-        self.assertEqual(parsed["project_date"], datetime(2025, 9, 25, 15, 30, 0))
-        self.assertEqual(parsed["project_client"], "clientA")
-        self.assertEqual(parsed["project_environment"], "prod")
+        self.assertEqual(parsed.project_name, "myproj")
+        self.assertEqual(parsed.project_hash, "1a2b3c4")
+        self.assertEqual(parsed.project_date, datetime(2025, 9, 25, 15, 30, 0))
+        self.assertEqual(parsed.project_client, "clientA")
+        self.assertEqual(parsed.project_environment, "prod")
 
     def test_parse_image_tag_valid_without_client(self):
         tag = "service-abcdef1-2022-01-01-00-00-00-staging"
         parsed = parse_image_tag(tag)
         self.assertIsNotNone(parsed)
-        self.assertEqual(parsed["project_name"], "service")
-        self.assertEqual(parsed["project_hash"], "abcdef1")
-        self.assertEqual(parsed["project_date"], datetime(2022, 1, 1, 0, 0, 0))
-        self.assertEqual(parsed["project_client"], "N/A")
-        self.assertEqual(parsed["project_environment"], "staging")
+        self.assertEqual(parsed.project_name, "service")
+        self.assertEqual(parsed.project_hash, "abcdef1")
+        self.assertEqual(parsed.project_date, datetime(2022, 1, 1, 0, 0, 0))
+        self.assertEqual(parsed.project_client, "N/A")
+        self.assertEqual(parsed.project_environment, "staging")
+
+    def test_parse_image_tag_valid_with_dashes(self):
+        tag = "my-proj-1a2b3c4-2025-09-25-15-30-00-client-a-prod"
+        parsed = parse_image_tag(tag)
+        self.assertIsNotNone(parsed)
+        self.assertEqual(parsed.project_name, "my-proj")
+        self.assertEqual(parsed.project_hash, "1a2b3c4")
+        self.assertEqual(parsed.project_date, datetime(2025, 9, 25, 15, 30, 0))
+        self.assertEqual(parsed.project_client, "client-a")
+        self.assertEqual(parsed.project_environment, "prod")
 
     def test_parse_image_tag_invalid(self):
         tag = "badformat-2025-09-25-15-30-00-client-prod"
         parsed = parse_image_tag(tag)
         self.assertIsNone(parsed)
 
+    def test_parse_image_tag_prefilter(self):
+        # Shorter than the shortest valid tag
+        self.assertIsNone(parse_image_tag("p-1a2b3c4-2025-09-25-15-30-00-"))
+        self.assertIsNotNone(parse_image_tag("p-1a2b3c4-2025-09-25-15-30-00-e"))
+        # Last character can't end an environment
+        self.assertIsNone(parse_image_tag("myproj-1a2b3c4-2025-09-25-15-30-00-prod1"))
+
+    def test_parse_image_tag_untagged(self):
+        self.assertIsNone(parse_image_tag(None))
+
+    def test_get_validated_images_matches_parse_image_tag(self):
+        images = [
+            {'imageDigest': 'd1', 'imageTag': "myproj-1a2b3c4-2025-09-25-15-30-00-clientA-prod"},
+            {'imageDigest': 'd2', 'imageTag': "badformat-2025-09-25-15-30-00-client-prod"},
+            {'imageDigest': 'd3'},
+            {'imageTag': "service-abcdef1-2022-01-01-00-00-00-staging"},
+            {'imageDigest': 'd4', 'imageTag': "service-abcdef1-2022-01-01-00-00-00-staging"},
+        ]
+
+        validated = list(get_validated_images(images))
+        self.assertEqual([image.image_digest for image in validated], ['d1', 'd4'])
+        for image, source in zip(validated, [images[0], images[4]]):
+            expected = parse_image_tag(source['imageTag'])
+            expected.image_digest = source['imageDigest']
+            self.assertEqual(image, expected)
+
+    def test_get_validated_images_with_workers(self):
+        images = [
+            {'imageDigest': f'd{i}', 'imageTag': f"proj-aaaaaaa-2025-01-01-00-00-{i % 60:02d}-prod"}
+            for i in range(2500)
+        ]
+
+        validated = list(get_validated_images(images, workers=2))
+        self.assertEqual([image.image_digest for image in validated], [image['imageDigest'] for image in images])
+
     def make_image(self, project_name, hash_, date_str, client, env, digest):
         parsed = parse_image_tag(f"{project_name}-{hash_}-{date_str}-{client}-{env}")
         self.assertIsNotNone(parsed)
-        parsed['imageDigest'] = digest
+        parsed.image_digest = digest
         return parsed
 
     def test_get_digests_by_status_grouping_and_retention(self):
@@ -50,6 +95,71 @@ class TestMain(unittest.TestCase):
         self.assertEqual(keep, {'d5', 'd4'})
         self.assertEqual(delete, {'d3', 'd2', 'd1'})
 
+    def test_get_digests_by_status_shared_digest(self):
+        images = [
+            {'imageDigest': 'd1', 'imageTag': "proj-aaaaaaa-2025-01-01-00-00-00-prod"},
+            {'imageDigest': 'd2', 'imageTag': "proj-bbbbbbb-2025-01-02-00-00-00-prod"},
+            {'imageDigest': 'd1', 'imageTag': "proj-aaaaaaa-2025-01-03-00-00-00-staging"},
+            {'imageDigest': 'd3', 'imageTag': "proj-ccccccc-2025-01-02-00-00-00-staging"},
+            {'imageDigest': 'd1', 'imageTag': "proj-aaaaaaa-2025-01-01-00-00-00-staging"},
+        ]
+
+        with self.assertLogs('main', level='INFO') as logs:
+            keep, delete = get_digests_by_status(get_validated_images(images), keep_versions=1)
+        self.assertEqual(keep, {'d2', 'd1'})
+        self.assertEqual(delete, {'d3'})
+        self.assertIn("Group: ('staging', 'N/A', 'proj') | Tags: 3 | Digests to keep: 1", "\n".join(logs.output))
+
+    def test_get_digests_by_status_refreshed_digest(self):
+        imgs = [
+            self.make_image('proj', 'aaaaaaa', '2025-01-01-00-00-00', 'C', 'prod', 'd1'),
+            self.make_image('proj', 'bbbbbbb', '2025-01-02-00-00-00', 'C', 'prod', 'd2'),
+            self.make_image('proj', 'aaaaaaa', '2025-01-04-00-00-00', 'C', 'prod', 'd1'),
+            self.make_image('proj', 'ccccccc', '2025-01-03-00-00-00', 'C', 'prod', 'd3'),
+        ]
+
+        # d1 is already kept when it comes back newer, so d2 becomes the oldest one kept
+        with self.assertLogs('main', level='INFO') as logs:
+            keep, delete = get_digests_by_status(imgs, keep_versions=2)
+        self.assertEqual(keep, {'d1', 'd3'})
+        self.assertEqual(delete, {'d2'})
+        self.assertIn("Tags: 4 | Digests to keep: 2", "\n".join(logs.output))
+
+    def test_get_digests_by_status_refreshed_digest_tie(self):
+        imgs = [
+            self.make_image('proj', 'bbbbbbb', '2025-01-01-00-00-00', 'C', 'prod', 'd2'),
+            self.make_image('proj', 'aaaaaaa', '2025-01-01-01-00-00', 'C', 'prod', 'd1'),
+            self.make_image('proj', 'bbbbbbb', '2025-01-01-01-00-00', 'C', 'prod', 'd2'),
+            self.make_image('proj', 'ccccccc', '2025-01-01-02-00-00', 'C', 'prod', 'd3'),
+        ]
+
+        # d2 comes back tying with d1, but d1 was seen first at that date and wins the tie
+        keep, delete = get_digests_by_status(imgs, keep_versions=2)
+        self.assertEqual(keep, {'d1', 'd3'})
+        self.assertEqual(delete, {'d2'})
+
+    def test_get_digests_by_status_large_keep_versions(self):
+        imgs = []
+        for i in range(600):
+            # 200 distinct digests per group, most of them tagged again later with a newer date
+            digest = f"d{i % 400}"
+            date = datetime(2025, 1, 1) + timedelta(minutes=(i * 37) % 600 + i // 400 * 600)
+            imgs.append(self.make_image(f"proj{i % 2}", 'aaaaaaa', date.strftime('%Y-%m-%d-%H-%M-%S'), 'C', 'prod', digest))
+
+        # Reference: newest date per distinct digest of a group, sorted
+        newest = {}
+        for image in imgs:
+            key = (image.project_name, image.image_digest)
+            newest[key] = max(newest.get(key, image.project_date), image.project_date)
+        expected_keep = set()
+        for name in ('proj0', 'proj1'):
+            ranked = sorted((date, digest) for (group, digest), date in newest.items() if group == name)
+            expected_keep |= {digest for _, digest in ranked[-150:]}
+
+        keep, delete = get_digests_by_status(imgs, keep_versions=150)
+        self.assertEqual(keep, expected_keep)
+        self.assertEqual(delete, {image.image_digest for image in imgs} - expected_keep)
+
 
 if __name__ == '__main__':
     unittest.main()